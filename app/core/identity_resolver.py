@@ -1,27 +1,114 @@
 # app/core/identity_resolver.py
 
-import json
 import os 
+import orjson
 from collections import defaultdict
+from functools import lru_cache
 from typing import Dict, List, Tuple
 from filelock import FileLock
 
-# --- Levenshtein Distance for fuzzy matching (no new library needed) ---
-def levenshtein_distance(s1, s2):
-    s1 = s1.lower()
-    s2 = s2.lower()
+# --- Levenshtein distance for fuzzy matching ---
+def bounded_levenshtein(s1, s2, max_dist=2):
+    """
+    Returns the Levenshtein distance if it is at most max_dist, otherwise None.
+    Only the diagonal band |i - j| <= max_dist is computed, and the scan stops
+    as soon as a whole row exceeds max_dist.
+    """
+    if abs(len(s1) - len(s2)) > max_dist:
+        return None
     if len(s1) > len(s2):
         s1, s2 = s2, s1
-    distances = range(len(s1) + 1)
-    for i2, c2 in enumerate(s2):
-        distances_ = [i2 + 1]
-        for i1, c1 in enumerate(s1):
-            if c1 == c2:
-                distances_.append(distances[i1])
+    too_far = max_dist + 1
+    previous = [j if j <= max_dist else too_far for j in range(len(s1) + 1)]
+    for i2, c2 in enumerate(s2, 1):
+        current = [too_far] * (len(s1) + 1)
+        current[0] = row_min = min(i2, too_far)
+        for i1 in range(max(1, i2 - max_dist), min(len(s1), i2 + max_dist) + 1):
+            if s1[i1 - 1] == c2:
+                distance = previous[i1 - 1]
             else:
-                distances_.append(1 + min((distances[i1], distances[i1 + 1], distances_[-1])))
-        distances = distances_
-    return distances[-1]
+                distance = 1 + min(previous[i1 - 1], previous[i1], current[i1 - 1])
+            current[i1] = min(distance, too_far)
+            row_min = min(row_min, current[i1])
+        if row_min > max_dist:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_dist else None
+
+@lru_cache(maxsize=1)
+def _load_bounded_distance():
+    """
+    Returns the fastest available bounded distance function: StringZilla's SIMD
+    kernel, or pure-Python bounded_levenshtein if it isn't installed.
+    Both count edits in code points, so "José" is one edit from "Jose".
+    """
+    try:
+        from stringzilla import edit_distance_unicode as edit_distance # Removed from the package in StringZilla 4
+    except ImportError:
+        return bounded_levenshtein
+
+    def native_bounded_distance(s1, s2, max_dist=2):
+        if abs(len(s1) - len(s2)) > max_dist:
+            return None
+        distance = edit_distance(s1, s2, bound=max_dist + 1)
+        return distance if distance <= max_dist else None
+    return native_bounded_distance
+
+# Maximum edit distance for two names to be treated as the same person; 0 disables fuzzy matching
+FUZZY_THRESHOLD = int(os.getenv("FUZZY_THRESHOLD", "2"))
+
+def _name_edit_distance(s1, s2, bound=None):
+    """
+    Exact edit distance when bound is None. With a bound, any distance above it comes back
+    as bound + 1, which is all a BK-tree lookup needs once it exceeds every child edge.
+    """
+    if bound is None:
+        bound = max(len(s1), len(s2))
+    distance = _load_bounded_distance()(s1, s2, bound)
+    return bound + 1 if distance is None else distance
+
+class BKTree:
+    """
+    A Burkhard-Keller tree for finding keys within an edit distance of a query. distance_fn(a, b, bound)
+    must be exact up to bound and return more than bound beyond it; with bound=None it must be exact.
+    """
+    def __init__(self, distance_fn):
+        self.distance_fn = distance_fn
+        self._root = None # (key, items, {distance: child_node})
+
+    def add(self, key, item):
+        """Inserts an item under key; items with identical keys share a node."""
+        if self._root is None:
+            self._root = (key, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = self.distance_fn(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [item], {})
+                return
+            node = child
+
+    def find(self, key, tolerance):
+        """Returns [(distance, item), ...] for all keys within tolerance, closest first."""
+        matches = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_key, items, children = nodes.pop()
+            # Beyond the largest child edge plus tolerance, neither this node nor any child can match,
+            # so the comparison only has to be exact up to there
+            distance = self.distance_fn(key, node_key, max(children, default=0) + tolerance)
+            if distance <= tolerance:
+                matches.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - tolerance <= child_distance <= distance + tolerance:
+                    nodes.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
 
 # --- Main Resolution Logic ---
 
@@ -30,29 +117,73 @@ class IdentityStore:
         self.store_path = store_path
         self.cluster_path = cluster_path
         self.lock = FileLock(f"{self.store_path}.lock")
+        self._dist_cache = None # Distance memo; only set while resolve_and_update runs
+        self._reload()
+
+    def _files_stamp(self):
+        """
+        (inode, mtime_ns, size) of the store and cluster files, used to tell whether another writer
+        touched them. Writers replace the files via os.replace, which installs a new inode, so a
+        rewrite is caught even when it lands within the mtime granularity and keeps the size.
+        """
+        stamp = []
+        for path in (self.store_path, self.cluster_path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def _reload(self):
+        """Reads both files from disk and rebuilds the in-memory indexes."""
+        self._stamp = self._files_stamp()
         self.store = self._load_json(self.store_path)
         self.clusters = self._load_json(self.cluster_path)
+        # Fuzzy merges already recorded per person, so repeats don't grow clusters.json
+        self._cluster_pairs = {
+            person_id: {tuple(entry) for entry in entries if isinstance(entry, list)}
+            for person_id, entries in self.clusters.items()
+        }
         self._pii_lookup = self._build_lookup_index()
+        self._name_bk_tree = self._build_name_bk_tree()
 
     def _load_json(self, path):
         """Safely loads a JSON file, creating it if it doesn't exist."""
-        if not os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
             return {}
-        with open(path, "r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
 
     def _build_lookup_index(self):
         """Creates a fast in-memory map of {pii_value: person_id}."""
-        lookup = {}
-        persons = self.store.get("persons", {})
-        for person_id, data in persons.items():
-            for pii_type, values in data.items():
-                for placeholder, value in values.items():
-                    lookup[value] = person_id
-        return lookup
+        return {
+            value: person_id
+            for person_id, data in self.store.get("persons", {}).items()
+            for values in data.values() if isinstance(values, dict)
+            for value in values.values()
+        }
+
+    def _build_name_bk_tree(self):
+        """Indexes every stored name, keyed by its lowercased form, for fuzzy lookups."""
+        tree = BKTree(self._name_distance)
+        for person_id, data in self.store.get("persons", {}).items():
+            for name in data.get("names", {}).values():
+                tree.add(name.lower(), (name, person_id))
+        return tree
+
+    def _name_distance(self, s1, s2, bound=None):
+        """Name distance, memoized while a resolve_and_update call runs and computed directly otherwise."""
+        if self._dist_cache is None:
+            return _name_edit_distance(s1, s2, bound)
+        key = (s1, s2, bound) if s1 <= s2 else (s2, s1, bound)
+        distance = self._dist_cache.get(key)
+        if distance is None:
+            distance = _name_edit_distance(*key)
+            self._dist_cache[key] = distance
+        return distance
 
     def _get_next_person_id(self):
         """Gets the next available person ID."""
@@ -60,6 +191,7 @@ class IdentityStore:
         last_index = metadata.get("last_person_index", -1)
         next_index = last_index + 1
         metadata["last_person_index"] = next_index
+        self._store_dirty = True
         return f"PERSON_{next_index}"
     
     def resolve_and_update(self, grouped_pii: Dict) -> Dict[str, str]:
@@ -68,53 +200,82 @@ class IdentityStore:
         Returns a map of {original_pii_value: placeholder} for the current document.
         """
         with self.lock:
-            # Reload the store inside the lock to get the absolute latest version
-            self.store = self._load_json(self.store_path)
-            self.clusters = self._load_json(self.cluster_path)
-            self._pii_lookup = self._build_lookup_index()
+            # Reload inside the lock only if another writer changed the files since our last load/save
+            if self._files_stamp() != self._stamp:
+                self._reload()
+            self._stamp = None # If anything below fails, in-memory state no longer matches disk
+            self._dist_cache = {} # Only lives for this call, so memory stays bounded by this document
+            try:
+                self._store_dirty = False
+                self._clusters_dirty = False
 
-            document_masking_map = {} # {original_pii: placeholder} for this doc
+                document_masking_map = {} # {original_pii: placeholder} for this doc
 
-            # Process persons first
-            for temp_person_id, pii_data in grouped_pii.get("persons", {}).items():
-                matched_person_id = self._find_match(pii_data)
+                # Process persons first, one at a time: each is matched against the store including
+                # whatever the persons before it in this document merged in
+                for pii_data in grouped_pii.get("persons", {}).values():
+                    matched_person_id = self._record_match(self._find_match_readonly(pii_data))
                 
-                if not matched_person_id:
-                    matched_person_id = self._get_next_person_id()
-                    self.store.setdefault("persons", {})[matched_person_id] = {}
+                    if not matched_person_id:
+                        matched_person_id = self._get_next_person_id()
+                        self.store.setdefault("persons", {})[matched_person_id] = {}
 
-                # Merge PII and create placeholders for this person
-                person_placeholders = self._merge_person_pii(matched_person_id, pii_data)
-                document_masking_map.update(person_placeholders)
+                    # Merge PII and create placeholders for this person
+                    person_placeholders = self._merge_person_pii(matched_person_id, pii_data)
+                    document_masking_map.update(person_placeholders)
 
-            # Process unlinked PII
-            unlinked_placeholders = self._process_unlinked_pii(grouped_pii.get("unlinked_pii", {}))
-            document_masking_map.update(unlinked_placeholders)
+                # Process unlinked PII
+                unlinked_placeholders = self._process_unlinked_pii(grouped_pii.get("unlinked_pii", {}))
+                document_masking_map.update(unlinked_placeholders)
 
-            # Save the updated store and clusters back to disk
-            self._save_json(self.store_path, self.store)
-            self._save_json(self.cluster_path, self.clusters)
+                # Save whichever of the store and clusters changed back to disk
+                if self._store_dirty:
+                    self._save_json(self.store_path, self.store)
+                if self._clusters_dirty:
+                    self._save_json(self.cluster_path, self.clusters)
+                self._stamp = self._files_stamp()
+            finally:
+                self._dist_cache = None
         
         return document_masking_map
 
-    def _find_match(self, new_pii_data: Dict) -> str | None:
-        """Finds a matching person_id for a new profile using exact and fuzzy matching."""
+    def _find_match_readonly(self, new_pii_data: Dict) -> Tuple[str, Tuple[str, str] | None] | None:
+        """
+        Finds a matching person for a new profile using exact and fuzzy matching.
+        Returns (person_id, (new_name, existing_name) if the match was fuzzy else None),
+        or None. Doesn't modify the store or clusters.
+        """
         # Exact match on high-certainty fields
         for pii_type in ["emails", "phones", "nrics", "ssns"]:
             for value in new_pii_data.get(pii_type, []):
                 if value in self._pii_lookup:
-                    return self._pii_lookup[value]
+                    return self._pii_lookup[value], None
         
         # Fuzzy match on names
-        for new_name in new_pii_data.get("names", []):
-            for existing_person_id, existing_data in self.store.get("persons", {}).items():
-                for existing_name in existing_data.get("names", {}).values():
-                    if levenshtein_distance(new_name, existing_name) <= 2: # Threshold of 2
-                        # Record the cluster/merge
-                        self.clusters.setdefault(existing_person_id, []).append(f"Fuzzy matched '{new_name}' with '{existing_name}'")
-                        return existing_person_id
+        new_names = new_pii_data.get("names")
+        if not new_names or FUZZY_THRESHOLD <= 0:
+            return None
+        for new_name in new_names:
+            matches = self._name_bk_tree.find(new_name.lower(), FUZZY_THRESHOLD)
+            if matches:
+                _, (existing_name, existing_person_id) = matches[0]
+                return existing_person_id, (new_name, existing_name)
         return None
 
+    def _record_match(self, match) -> str | None:
+        """Records a fuzzy match from _find_match_readonly in the clusters and returns the matched person_id."""
+        if match is None:
+            return None
+        person_id, fuzzy_pair = match
+        if fuzzy_pair:
+            # Record the cluster/merge as a [new_name, existing_name] pair, once per pair
+            pairs = self._cluster_pairs.setdefault(person_id, set())
+            if fuzzy_pair not in pairs:
+                pairs.add(fuzzy_pair)
+                self.clusters.setdefault(person_id, []).append(list(fuzzy_pair))
+                self._clusters_dirty = True
+        return person_id
+
     def _merge_person_pii(self, person_id: str, pii_data: Dict) -> Dict[str, str]:
         """Merges new PII into an existing person's profile and returns placeholders."""
         person_profile = self.store["persons"][person_id]
@@ -138,6 +299,9 @@ class IdentityStore:
                     
                     person_profile[pii_type_plural][placeholder] = value
                     self._pii_lookup[value] = person_id # Update live index
+                    self._store_dirty = True
+                    if pii_type_plural == "names":
+                        self._name_bk_tree.add(value.lower(), (value, person_id))
                     placeholders[value] = placeholder
         
         return placeholders
@@ -150,20 +314,26 @@ class IdentityStore:
         counters = metadata.setdefault("unlinked_pii_counters", {})
 
         for pii_type, values in unlinked_data.items():
-            unlinked_store.setdefault(pii_type, {})
+            bucket = unlinked_store.setdefault(pii_type, {})
+            existing_values = set(bucket.values())
             
             for value in values:
                 # To avoid re-adding if seen before (less likely but safe)
-                if value not in unlinked_store[pii_type].values():
+                if value not in existing_values:
                     current_index = counters.get(pii_type.upper(), 0)
                     placeholder = f"[UNMATCHED_{pii_type.upper()}_{current_index}]"
                     
-                    unlinked_store[pii_type][placeholder] = value
+                    bucket[placeholder] = value
+                    existing_values.add(value)
+                    self._store_dirty = True
                     placeholders[value] = placeholder
                     counters[pii_type.upper()] = current_index + 1
 
         return placeholders
 
     def _save_json(self, path, data):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
\ No newline at end of file
+        """Writes to a temp file and renames it over the target, so a crash never leaves a truncated file."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, path)
\ No newline at end of file
@@ -1,6 +1,8 @@
 # app/core/masking.py
 
-import os, json, re, requests
+import os, json, re, asyncio
+import ahocorasick
+import httpx
 from typing import Dict, List
 
 # Load config directly here as it's self-contained
@@ -10,6 +12,16 @@ WS_SLUG  = os.getenv("ANYTHINGLLM_WS")
 CHAT_URL = f"{API_URL}/api/v1/workspace/{WS_SLUG}/chat"
 HEADERS  = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
 
+# Shared client so LLM calls reuse pooled connections and never block the event loop
+_client = httpx.AsyncClient(headers=HEADERS, timeout=120)
+
+# Documents longer than this are split on paragraph breaks and extracted concurrently
+EXTRACTION_CHUNK_CHARS = int(os.getenv("EXTRACTION_CHUNK_CHARS", "8000"))
+# Most extraction calls in flight at once across all requests, so a long document doesn't queue
+# dozens of prompts at the LLM, each racing its own timeout
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "4"))
+_extraction_slots = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+
 # --- Prompt 1: Simple PII Extraction ---
 EXTRACTION_PROMPT = """
 You are a PII (Personally Identifiable Information) extraction machine.
@@ -47,11 +59,56 @@ You are an entity resolution expert. Your job is to group the provided list of P
 ---
 """
 
-def extract_pii_flat_list(text: str) -> List[Dict]:
+async def close_client():
+    """Closes the shared LLM HTTP client; called on application shutdown."""
+    await _client.aclose()
+
+def _split_text(text: str, max_chars: int = EXTRACTION_CHUNK_CHARS, separators=("\n\n", "\n")) -> List[str]:
+    """
+    Splits text into chunks of at most max_chars, cutting at blank lines where possible,
+    then at line breaks, and only mid-line for a single line longer than max_chars.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    if not separators:
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+    separator, finer_separators = separators[0], separators[1:]
+    chunks, current, current_len = [], [], 0
+    for piece in text.split(separator):
+        if current and current_len + len(piece) > max_chars:
+            chunks.append(separator.join(current))
+            current, current_len = [], 0
+        if len(piece) > max_chars:
+            chunks.extend(_split_text(piece, max_chars, finer_separators))
+            continue
+        current.append(piece)
+        current_len += len(piece) + len(separator)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+async def extract_pii_flat_list(text: str) -> List[Dict]:
     """Step 1: Gets a simple flat list of all PII from the text."""
+    chunks = _split_text(text)
+
+    # Extract each chunk concurrently, then drop malformed entities and ones found in more than one chunk
+    pii_list, seen = [], set()
+    for chunk_pii in await asyncio.gather(*(_extract_pii_chunk(chunk) for chunk in chunks)):
+        for entity in chunk_pii:
+            if not isinstance(entity, dict):
+                continue
+            key = (entity.get("type"), entity.get("value"))
+            if key not in seen:
+                seen.add(key)
+                pii_list.append(entity)
+    return pii_list
+
+async def _extract_pii_chunk(text: str) -> List[Dict]:
     prompt = EXTRACTION_PROMPT.format(text=text)
     payload = {"message": prompt, "mode": "chat", "options": {"temperature": 0}}
-    resp = requests.post(CHAT_URL, headers=HEADERS, json=payload, timeout=90)
+    async with _extraction_slots:
+        resp = await _client.post(CHAT_URL, json=payload, timeout=90)
     resp.raise_for_status()
     raw_response = resp.json().get("textResponse", "[]")
     
@@ -61,12 +118,12 @@ def extract_pii_flat_list(text: str) -> List[Dict]:
         return json.loads(match.group(0))
     return []
 
-def group_pii_with_context(text: str, pii_list: List[Dict]) -> Dict:
+async def group_pii_with_context(text: str, pii_list: List[Dict]) -> Dict:
     """Step 2: Takes the flat PII list and asks the LLM to group it based on context."""
     pii_list_json = json.dumps(pii_list, indent=2)
     prompt = GROUPING_PROMPT.format(text=text, pii_list_json=pii_list_json)
     payload = {"message": prompt, "mode": "chat", "options": {"temperature": 0.1}}
-    resp = requests.post(CHAT_URL, headers=HEADERS, json=payload, timeout=120)
+    resp = await _client.post(CHAT_URL, json=payload, timeout=120)
     resp.raise_for_status()
     raw_response = resp.json().get("textResponse", "{}")
 
@@ -74,4 +131,59 @@ def group_pii_with_context(text: str, pii_list: List[Dict]) -> Dict:
     match = re.search(r'\{.*\}', raw_response, re.DOTALL)
     if match:
         return json.loads(match.group(0))
-    return {"persons": {}, "unlinked_pii": {}}
\ No newline at end of file
+    return {"persons": {}, "unlinked_pii": {}}
+
+def mask_text(text: str, masking_map: Dict[str, str]) -> str:
+    """Replaces every case-insensitive occurrence of each PII value with its placeholder in one pass over the text."""
+    if not masking_map:
+        return text
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Lowercasing shifted character offsets (e.g. 'İ'), so matches can't be mapped back onto the original text
+        return _mask_text_regex(text, masking_map)
+
+    automaton = ahocorasick.Automaton()
+    for value, placeholder in masking_map.items():
+        key = value.lower()
+        # The first of several case variants keeps its placeholder, as in _mask_text_regex
+        if key and not automaton.exists(key):
+            automaton.add_word(key, (len(key), placeholder))
+    if len(automaton) == 0:
+        return text
+    automaton.make_automaton()
+
+    # Longest values win overlaps, as they did when values were replaced longest-first. iter_long
+    # isn't used: it drops a shorter value that sits inside a longer value's failed partial match.
+    matches = sorted(
+        ((end - length + 1, length, placeholder) for end, (length, placeholder) in automaton.iter(lowered)),
+        key=lambda match: (-match[1], match[0]),
+    )
+    covered = bytearray(len(text))
+    accepted = []
+    for start, length, placeholder in matches:
+        if covered.find(1, start, start + length) == -1:
+            covered[start:start + length] = b"\x01" * length
+            accepted.append((start, length, placeholder))
+    accepted.sort()
+
+    parts, position = [], 0
+    for start, length, placeholder in accepted:
+        parts.append(text[position:start])
+        parts.append(placeholder)
+        position = start + length
+    parts.append(text[position:])
+    return "".join(parts)
+
+def _mask_text_regex(text: str, masking_map: Dict[str, str]) -> str:
+    """Fallback using one case-insensitive alternation of all values, longest first so it wins over its substrings."""
+    placeholders = {}
+    for value, placeholder in masking_map.items():
+        if value:
+            placeholders.setdefault(value.casefold(), placeholder)
+    if not placeholders:
+        return text
+    pattern = re.compile(
+        "|".join(re.escape(value) for value in sorted((v for v in masking_map if v), key=len, reverse=True)),
+        re.IGNORECASE,
+    )
+    return pattern.sub(lambda m: placeholders.get(m.group(0).casefold(), m.group(0)), text)
@@ -0,0 +1,72 @@
+# app/core/pdf_extraction.py
+
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fitz  # PyMuPDF
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    """Loads PyMuPDF and its base fonts once per worker process instead of on each document."""
+    with fitz.open() as doc:
+        doc.new_page().get_text()
+
+
+def _extract_pdf_text(data: bytes) -> str:
+    # Pages go straight into one buffer; sort=False skips PyMuPDF's block re-ordering, which the LLM doesn't need
+    buffer = io.StringIO()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for page in doc:
+            buffer.write(page.get_text("text", sort=False))
+    return buffer.getvalue()
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """
+    Extracts the text of a PDF on a shared pool of warm worker processes, so concurrent
+    uploads parse in parallel instead of contending for the GIL. Blocks until done.
+    """
+    executor = _get_executor()
+    try:
+        return executor.submit(_extract_pdf_text, data).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. MuPDF crashed on this file, or it was OOM-killed). The pool can't
+        # recover from that, so drop it and let the next upload start a fresh one.
+        _discard_executor(executor)
+        raise
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers are spawned rather than forked from the threaded server process
+            _executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Stops the worker processes; called on application shutdown."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
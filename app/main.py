@@ -1,10 +1,27 @@
 # app/main.py
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Response # <--- Add 'Response' to the import
 
 # from app.core.masking import load_spacy_model # This is correctly removed
+from app.core.masking import close_client
+from app.core.identity_resolver import IdentityStore
+from app.core.pdf_extraction import shutdown_pool
 from app.routes import documents as text_processing_router # This import is correct
 
-app = FastAPI(title="LLM-Powered Text PII Masking API")
+# Set LOG_LEVEL=WARNING in production to skip formatting the per-request status messages entirely
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One store per process; it only re-reads its files when another process changed them
+    app.state.identity_store = IdentityStore()
+    yield
+    await close_client()
+    shutdown_pool()
+
+app = FastAPI(title="LLM-Powered Text PII Masking API", lifespan=lifespan)
 app.include_router(text_processing_router.router, prefix="/text", tags=["Text Processing"])
 
 # dummy endpoint to resolve error in console
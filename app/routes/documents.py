@@ -3,24 +3,51 @@
 import os
 import re
 import uuid
-import json
-import traceback
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import orjson
+import asyncio
+import logging
+import zipfile
+import aiofiles
+import aiofiles.os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Depends
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from app.core.masking import extract_pii_flat_list, group_pii_with_context
+from app.core.masking import extract_pii_flat_list, group_pii_with_context, mask_text
 from app.core.identity_resolver import IdentityStore
-import fitz  # PyMuPDF
-import docx  # For .docx files
+from app.core.pdf_extraction import extract_pdf_text
+from lxml import etree  # For .docx files
 
 router = APIRouter()
+log = logging.getLogger(__name__)
+
+# Serializes in-process use of the shared IdentityStore; its FileLock only guards against other processes
+_identity_lock = asyncio.Lock()
+
+# Bounded pool for blocking file I/O and parsing, so a burst of uploads can't spawn unbounded threads
+_io_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="documents-io")
 
-UPLOAD_DIR = "data/uploads"
 MASKED_TXTS_DIR = "data/masked_txts"
 UNMASKED_TXTS_DIR = "data/unmasked_txts"
 IDENTITY_STORE_PATH = "data/identity_store.json"
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# WordprocessingML tags for paragraphs and text runs, and the .docx parts that carry body text
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P = f"{_W_NS}p"
+_W_R = f"{_W_NS}r"
+_W_T = f"{_W_NS}t"
+# Run-level tab and line breaks, rendered the way python-docx rendered them
+_W_RUN_BREAKS = {f"{_W_NS}tab": "\t", f"{_W_NS}br": "\n", f"{_W_NS}cr": "\n"}
+# Word stores a text box twice, as DrawingML under mc:Choice and again as VML under mc:Fallback
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+_DOCX_TEXT_PART_RE = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml')
+
+# Placeholders as IdentityStore writes them, e.g. [PERSON_0_NAMES_0] or [UNMATCHED_EMAILS_3]. The fixed
+# prefix lets the scan reject ordinary bracketed text like "[1]" or "[sic]" at its first characters.
+_PLACEHOLDER_RE = re.compile(r'\[(?:PERSON_\d+|UNMATCHED)_[^\[\]\n]+_\d+\]')
+
 os.makedirs(MASKED_TXTS_DIR, exist_ok=True)
 os.makedirs(UNMASKED_TXTS_DIR, exist_ok=True)
 
@@ -29,90 +56,182 @@ class DemaskRequest(BaseModel):
     masked_text: str
 
 
+def get_store(request: Request) -> IdentityStore:
+    return request.app.state.identity_store
+
+
+async def _run_blocking(func, *args):
+    """Runs a blocking call on the I/O pool without holding up the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, func, *args)
+
+
+async def _write_text_atomic(path: str, text: str):
+    """
+    Writes to a temp file and renames it into place, so readers never see a partially written file.
+    The text is encoded in one pass and written as a single bytes buffer, not chunked through a text wrapper.
+    """
+    tmp_path = f"{path}.tmp"
+    data = text.encode("utf-8")
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f_out:
+            await f_out.write(data)
+        await aiofiles.os.replace(tmp_path, path)
+    except BaseException:
+        await _silent_remove(tmp_path)
+        raise
+
+
+async def _silent_remove(path: str):
+    """Removes a file if it exists, in one syscall rather than an exists() check plus remove()."""
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _load_identity_store() -> dict:
+    with open(IDENTITY_STORE_PATH, "rb") as f:
+        return orjson.loads(f.read())
+
+
+@lru_cache(maxsize=4)
+def _reverse_map_for(store_stamp) -> dict:
+    """
+    Builds {placeholder: original_value} from the identity store. Cached on the file's
+    (inode, mtime_ns, size), so repeated demask calls skip the load and build until the store
+    changes. Callers must not modify the returned dict.
+    """
+    identity_store = _load_identity_store()
+    reverse_map = {}
+    for person_data in identity_store.get("persons", {}).values():
+        for pii_category in person_data.values():
+            if isinstance(pii_category, dict):
+                reverse_map.update(pii_category)
+                
+    for pii_category in identity_store.get("unlinked_pii", {}).values():
+        if isinstance(pii_category, dict):
+            reverse_map.update(pii_category)
+    return reverse_map
+
+
+def _docx_part_paragraphs(xml: bytes) -> List[str]:
+    """
+    Returns the text of each paragraph in one WordprocessingML part, found in a single lxml walk.
+    Runs are joined within their own paragraph, so a name split across runs stays on one line and
+    a text box's paragraphs aren't folded into (and duplicated by) the paragraph anchoring it.
+    mc:Fallback copies are skipped, so each text box is read once.
+    """
+    paragraphs, open_paragraphs = [], []
+    walk = etree.iterwalk(etree.fromstring(xml), events=("start", "end"), tag=(_W_P, _W_T, *_W_RUN_BREAKS, _MC_FALLBACK))
+    for event, element in walk:
+        if element.tag == _MC_FALLBACK:
+            if event == "start":
+                walk.skip_subtree()
+        elif element.tag == _W_P:
+            if event == "start":
+                open_paragraphs.append([])
+            else:
+                paragraphs.append("".join(open_paragraphs.pop()))
+        elif event == "start" and open_paragraphs:
+            if element.tag == _W_T:
+                if element.text:
+                    open_paragraphs[-1].append(element.text)
+            elif element.getparent().tag == _W_R: # w:tab also defines tab stops inside paragraph properties
+                open_paragraphs[-1].append(_W_RUN_BREAKS[element.tag])
+    return paragraphs
+
+
+def _extract_pdf(source: BinaryIO) -> str:
+    return extract_pdf_text(source.read())
+
+
+def _extract_txt(source: BinaryIO) -> str:
+    # Same newline translation a text-mode open() applies, so CRLF files don't carry "\r" into prompts or output
+    return source.read().decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _extract_docx(source: BinaryIO) -> str:
+    # Walk the XML directly with lxml instead of python-docx's per-paragraph/per-cell wrappers.
+    # Headers, footers and notes are included too, body first.
+    with zipfile.ZipFile(source) as archive:
+        parts = sorted(
+            (name for name in archive.namelist() if _DOCX_TEXT_PART_RE.fullmatch(name)),
+            key=lambda name: name != "word/document.xml",
+        )
+        return "\n".join(
+            paragraph for name in parts for paragraph in _docx_part_paragraphs(archive.read(name))
+        )
+
+
+# Plain-text extractors for uploaded file objects, by lowercase extension. Blocking; run them off the event loop.
+_EXTRACTORS = {
+    "pdf": _extract_pdf,
+    "txt": _extract_txt,
+    "docx": _extract_docx,
+}
+
+
 @router.post("/mask-document", tags=["Document Processing"])
-async def mask_document_endpoint(file: UploadFile = File(...)):
+async def mask_document_endpoint(file: UploadFile = File(...), identity_manager: IdentityStore = Depends(get_store)):
     """
     Uploads a document, performs PII extraction and identity resolution,
     and returns a masked text file.
     """
     file_id = str(uuid.uuid4())
-    original_file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    masked_txt_path = os.path.join(MASKED_TXTS_DIR, f"masked_{file_id}.txt")
-
-    with open(original_file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    masked_txt_path = f"{MASKED_TXTS_DIR}/masked_{file_id}.txt"
 
     # --- 1. Text Extraction ---
+    # Parsed straight from the upload's spooled file (in memory when small, a temp file
+    # otherwise) rather than copied to an uploads directory, read back and deleted again.
+    file_extension = os.path.splitext(file.filename or "")[1][1:].lower()
+    extractor = _EXTRACTORS.get(file_extension)
+    if extractor is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
+
     try:
-        print(f"[STATUS] Step 1/5: Extracting text from '{file.filename}'...")
-        full_text = ""
-        file_extension = file.filename.lower().split('.')[-1]
-        if file_extension == "pdf":
-            with fitz.open(original_file_path) as doc:
-                full_text = "".join(page.get_text() for page in doc)
-        elif file_extension == "txt":
-            with open(original_file_path, "r", encoding="utf-8") as f:
-                full_text = f.read()
-        elif file_extension == "docx":
-            doc = docx.Document(original_file_path)
-            text_parts = [p.text for p in doc.paragraphs]
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text_parts.append(cell.text)
-            full_text = "\n".join(text_parts)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type.")
+        log.debug("Step 1/5: Extracting text from '%s'...", file.filename)
+        full_text = await _run_blocking(extractor, file.file)
         
         if not full_text.strip():
             raise HTTPException(status_code=400, detail="File contains no text.")
             
     except Exception as e:
-        if os.path.exists(original_file_path): os.remove(original_file_path)
         raise HTTPException(status_code=500, detail=f"Failed to extract text: {e}")
 
     # --- 2. PII Processing Workflow ---
     try:
-        print("[STATUS] Step 2/5: Sending text to LLM for initial PII extraction...")
-        pii_list = extract_pii_flat_list(full_text)
-        print(f"[STATUS] -> Found {len(pii_list)} potential PII entities.")
+        log.debug("Step 2/5: Sending text to LLM for initial PII extraction...")
+        pii_list = await extract_pii_flat_list(full_text)
+        log.debug("-> Found %d potential PII entities.", len(pii_list))
         
         if not pii_list:
-            if os.path.exists(original_file_path): os.remove(original_file_path)
             return PlainTextResponse(content=full_text, media_type='text/plain')
 
-        print("[STATUS] Step 3/5: Sending PII list to LLM for contextual grouping...")
-        grouped_pii = group_pii_with_context(full_text, pii_list)
-        person_count = len(grouped_pii.get("persons", {}))
-        unlinked_count = len(grouped_pii.get("unlinked_pii", {}))
-        print(f"[STATUS] -> LLM grouped PII into {person_count} profile(s) and found {unlinked_count} unlinked category(ies).")
+        log.debug("Step 3/5: Sending PII list to LLM for contextual grouping...")
+        grouped_pii = await group_pii_with_context(full_text, pii_list)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-> LLM grouped PII into %d profile(s) and found %d unlinked category(ies).",
+                      len(grouped_pii.get("persons", {})), len(grouped_pii.get("unlinked_pii", {})))
         
-        print("[STATUS] Step 4/5: Resolving identities and updating knowledge store...")
-        identity_manager = IdentityStore()
-        document_masking_map = identity_manager.resolve_and_update(grouped_pii)
-        print("[STATUS] -> Knowledge store updated.")
+        log.debug("Step 4/5: Resolving identities and updating knowledge store...")
+        async with _identity_lock:
+            document_masking_map = await _run_blocking(identity_manager.resolve_and_update, grouped_pii)
+        log.debug("-> Knowledge store updated.")
 
-        masked_text = full_text
-        for original_value, placeholder in sorted(document_masking_map.items(), key=lambda item: len(item[0]), reverse=True):
-            masked_text = re.sub(re.escape(original_value), placeholder, masked_text, flags=re.IGNORECASE)
-        print("[STATUS] Step 5/5: Text masking complete.")
+        masked_text = mask_text(full_text, document_masking_map)
+        log.debug("Step 5/5: Text masking complete.")
 
         # Save the final masked file
-        with open(masked_txt_path, "w", encoding="utf-8") as f_out:
-            f_out.write(masked_text)
+        await _write_text_atomic(masked_txt_path, masked_text)
         
         # --- ADDED SUCCESS MESSAGE ---
-        print(f"\n[SUCCESS] Masked file saved successfully to: {masked_txt_path}\n")
+        log.info("Masked file saved successfully to: %s", masked_txt_path)
 
     except Exception as e:
-        traceback.print_exc()
-        if os.path.exists(original_file_path): os.remove(original_file_path)
+        log.exception("PII processing failed for '%s'", file.filename)
         raise HTTPException(status_code=500, detail=f"An error occurred during PII processing: {e}")
 
-    # --- 3. Cleanup and Respond ---
-    if os.path.exists(original_file_path):
-        os.remove(original_file_path)
-    
+    # --- 3. Respond ---
     return PlainTextResponse(content=masked_text, media_type='text/plain')
 
 
@@ -122,49 +241,42 @@ async def demask_text_endpoint(request: DemaskRequest):
     Accepts masked text, finds all placeholders, saves the demasked
     text to a file, and returns the demasked text in the response.
     """
-    print("\n[STATUS] Demasking request received.")
+    log.debug("Demasking request received.")
     
     unmasked_file_id = str(uuid.uuid4())
-    unmasked_txt_path = os.path.join(UNMASKED_TXTS_DIR, f"demasked_{unmasked_file_id}.txt")
+    unmasked_txt_path = f"{UNMASKED_TXTS_DIR}/demasked_{unmasked_file_id}.txt"
     
-    if not os.path.exists(IDENTITY_STORE_PATH):
+    try:
+        store_stat = os.stat(IDENTITY_STORE_PATH)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Identity store not found. Cannot demask.")
         
-    with open(IDENTITY_STORE_PATH, "r", encoding="utf-8") as f:
-        identity_store = json.load(f)
-    print("[STATUS] -> Loaded identity store.")
-
-    reverse_map = {}
-    for person_data in identity_store.get("persons", {}).values():
-        for pii_category in person_data.values():
-            if isinstance(pii_category, dict):
-                reverse_map.update(pii_category)
-                
-    for pii_category in identity_store.get("unlinked_pii", {}).values():
-        if isinstance(pii_category, dict):
-            reverse_map.update(pii_category)
-    print(f"[STATUS] -> Built reverse map with {len(reverse_map)} total entries.")
+    reverse_map = await _run_blocking(_reverse_map_for, (store_stat.st_ino, store_stat.st_mtime_ns, store_stat.st_size))
+    log.debug("-> Loaded reverse map with %d total entries.", len(reverse_map))
 
     masked_text = request.masked_text
-    demasked_text = masked_text
-    
-    placeholders_found = re.findall(r'(\[.+?\])', masked_text)
-    print(f"[STATUS] -> Found {len(placeholders_found)} placeholders in the text.")
-    
-    for placeholder in placeholders_found:
+    placeholders_found = 0
+
+    def _demask_placeholder(match):
+        nonlocal placeholders_found
+        placeholders_found += 1
+        placeholder = match.group(0)
         original_value = reverse_map.get(placeholder)
         if original_value:
-            demasked_text = demasked_text.replace(placeholder, original_value)
-        else:
-            print(f"[WARNING] Found placeholder '{placeholder}' in text but not in identity store. Skipping.")
+            return original_value
+        log.warning("Found placeholder '%s' in text but not in identity store. Skipping.", placeholder)
+        return placeholder
+
+    # One pass over the text instead of a findall plus a full str.replace per placeholder
+    demasked_text = _PLACEHOLDER_RE.sub(_demask_placeholder, masked_text)
+    log.debug("-> Found %d placeholders in the text.", placeholders_found)
             
     try:
-        with open(unmasked_txt_path, "w", encoding="utf-8") as f_out:
-            f_out.write(demasked_text)
+        await _write_text_atomic(unmasked_txt_path, demasked_text)
         # --- ADDED SUCCESS MESSAGE ---
-        print(f"[SUCCESS] Demasked file saved successfully to: {unmasked_txt_path}\n")
+        log.info("Demasked file saved successfully to: %s", unmasked_txt_path)
     except Exception as e:
-        print(f"[ERROR] Failed to save demasked file: {e}")
+        log.error("Failed to save demasked file: %s", e)
             
-    print("[STATUS] -> Demasking complete.")
+    log.debug("-> Demasking complete.")
     return PlainTextResponse(content=demasked_text)
\ No newline at end of file
@@ -0,0 +1,3 @@
+# conftest.py
+
+# Kept at the repo root so plain `pytest` puts the root on sys.path and `import app` resolves
@@ -17,24 +17,33 @@ HEADERS = {
     "Content-Type": "application/json",
 }
 
+# One keep-alive session, so repeated calls reuse the connection instead of reconnecting each time
+_session = requests.Session()
+_session.headers.update(HEADERS)
+_adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 # Use the same prompt structure from your app
 ALLOWED_PII_TYPES = [
     "Name", "EmailAddress", "PhoneNumber", "PhysicalAddress",
     "SocialSecurityNumber", "SingaporeNRIC", "DateOfBirth"
 ]
-PROMPT_TEMPLATE = f"""
+# Split around the text so each prompt is a plain concatenation rather than a .format() parse
+_PROMPT_PREFIX = f"""
 You are an expert PII extractor. Return **only** a JSON array of objects. Each object must have two keys: "type" (one of {', '.join(ALLOWED_PII_TYPES)}) and "value".
 
 TEXT TO ANALYSE:
 ---
-{{text}}
+"""
+_PROMPT_SUFFIX = """
 ---
 JSON Response:
 """
 SAMPLE_TEXT = "Contact Jane Doe at jane.doe@example.com."
 
 PAYLOAD = {
-    "message": PROMPT_TEMPLATE.format(text=SAMPLE_TEXT),
+    "message": _PROMPT_PREFIX + SAMPLE_TEXT + _PROMPT_SUFFIX,
     "mode": "chat",
     "options": {"temperature": 0.0}
 }
@@ -51,7 +60,7 @@ def test_anythingllm_connection():
     print(f"Attempting to call API at: {CHAT_URL}")
 
     try:
-        response = requests.post(CHAT_URL, headers=HEADERS, json=PAYLOAD, timeout=90)
+        response = _session.post(CHAT_URL, json=PAYLOAD, timeout=90)
         
         print(f"\n[OK] Request Sent. HTTP Status Code: {response.status_code}")
         
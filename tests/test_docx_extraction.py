@@ -0,0 +1,41 @@
+# tests/test_docx_extraction.py
+
+from app.routes.documents import _docx_part_paragraphs
+
+_DOCUMENT = (
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    ' xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+    ' xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"'
+    ' xmlns:v="urn:schemas-microsoft-com:vml">'
+    '<w:body>{}</w:body></w:document>'
+)
+
+
+def _paragraphs(body: str):
+    return _docx_part_paragraphs(_DOCUMENT.format(body).encode())
+
+
+def test_runs_are_joined_per_paragraph():
+    body = '<w:p><w:r><w:t>John </w:t></w:r><w:r><w:t>Tan</w:t></w:r></w:p><w:p><w:r><w:t>Next</w:t></w:r></w:p>'
+    assert _paragraphs(body) == ["John Tan", "Next"]
+
+
+def test_tabs_and_breaks_are_kept():
+    body = (
+        '<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr>'
+        '<w:r><w:t>Name:</w:t><w:tab/><w:t>John Tan</w:t></w:r></w:p>'
+        '<w:p><w:r><w:t>Line1</w:t><w:br/><w:t>Mary Lim</w:t><w:cr/><w:t>End</w:t></w:r></w:p>'
+    )
+    assert _paragraphs(body) == ["Name:\tJohn Tan", "Line1\nMary Lim\nEnd"]
+
+
+def test_text_box_is_read_once():
+    # Word writes each text box as DrawingML in mc:Choice and again as VML in mc:Fallback
+    text_box = '<w:txbxContent><w:p><w:r><w:t>Box John Tan</w:t></w:r></w:p></w:txbxContent>'
+    body = (
+        '<w:p><w:r><mc:AlternateContent>'
+        f'<mc:Choice Requires="wps"><w:drawing><wps:wsp><wps:txbx>{text_box}</wps:txbx></wps:wsp></w:drawing></mc:Choice>'
+        f'<mc:Fallback><w:pict><v:shape><v:textbox>{text_box}</v:textbox></v:shape></w:pict></mc:Fallback>'
+        '</mc:AlternateContent></w:r><w:r><w:t>Anchor</w:t></w:r></w:p>'
+    )
+    assert _paragraphs(body) == ["Box John Tan", "Anchor"]
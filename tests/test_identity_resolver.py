@@ -0,0 +1,122 @@
+# tests/test_identity_resolver.py
+
+import os
+import random
+
+from app.core.identity_resolver import (
+    BKTree, IdentityStore, _load_bounded_distance, _name_edit_distance, bounded_levenshtein,
+)
+
+_ALPHABET = "aeiost nëéöŁ漢"
+
+
+def _levenshtein(s1, s2):
+    """Plain full-matrix reference."""
+    previous = list(range(len(s2) + 1))
+    for i1, c1 in enumerate(s1, 1):
+        current = [i1]
+        for i2, c2 in enumerate(s2, 1):
+            current.append(min(previous[i2] + 1, current[i2 - 1] + 1, previous[i2 - 1] + (c1 != c2)))
+        previous = current
+    return previous[-1]
+
+
+def _random_pairs(count, max_len=12, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield (
+            "".join(rng.choices(_ALPHABET, k=rng.randint(0, max_len))),
+            "".join(rng.choices(_ALPHABET, k=rng.randint(0, max_len))),
+        )
+
+
+def test_distance_kernels_agree_with_reference():
+    native = _load_bounded_distance()
+    for s1, s2 in _random_pairs(3000):
+        expected = _levenshtein(s1, s2)
+        assert _name_edit_distance(s1, s2) == expected
+        for max_dist in (0, 1, 2, 5):
+            bounded = expected if expected <= max_dist else None
+            assert bounded_levenshtein(s1, s2, max_dist) == bounded
+            assert native(s1, s2, max_dist) == bounded
+            assert _name_edit_distance(s1, s2, max_dist) == min(expected, max_dist + 1)
+
+
+def test_distance_counts_code_points():
+    assert _name_edit_distance("josé tan", "jose tan") == 1
+    assert _name_edit_distance("zoë lim", "zoe lin") == 2
+
+
+def test_bk_tree_find_matches_linear_scan():
+    keys = sorted({s for pair in _random_pairs(300, seed=1) for s in pair})
+    tree = BKTree(_name_edit_distance)
+    for index, key in enumerate(keys):
+        tree.add(key, index)
+    for query, _ in _random_pairs(100, seed=2):
+        distances = [(_levenshtein(query, key), index) for index, key in enumerate(keys)]
+        for tolerance in (0, 1, 2, 3):
+            expected = sorted(match for match in distances if match[0] <= tolerance)
+            found = tree.find(query, tolerance)
+            assert sorted(found) == expected
+            assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+
+def test_resolve_and_update_round_trips_through_disk(tmp_path):
+    store_path, cluster_path = str(tmp_path / "identity_store.json"), str(tmp_path / "clusters.json")
+    store = IdentityStore(store_path, cluster_path)
+    first = store.resolve_and_update({
+        "persons": {"person_0": {"name": ["Jon Tan"], "emails": ["jon@x.com"]}},
+        "unlinked_pii": {"phone": ["555-0100"]},
+    })
+    assert first == {
+        "Jon Tan": "[PERSON_0_NAME_0]",
+        "jon@x.com": "[PERSON_0_EMAILS_0]",
+        "555-0100": "[UNMATCHED_PHONE_0]",
+    }
+
+    reloaded = IdentityStore(store_path, cluster_path)
+    assert reloaded.store == store.store
+    assert reloaded._pii_lookup == {"Jon Tan": "PERSON_0", "jon@x.com": "PERSON_0"}
+
+    # Matched exactly on the stored email, so the new name joins PERSON_0
+    second = reloaded.resolve_and_update({"persons": {"person_0": {"name": ["John Tan"], "emails": ["jon@x.com"]}}})
+    assert second == {"John Tan": "[PERSON_0_NAME_1]"}
+
+    # Matched fuzzily on a stored name, which is recorded as a cluster pair
+    third = reloaded.resolve_and_update({"persons": {"person_0": {"names": ["Jon Tam"]}}})
+    assert list(third) == ["Jon Tam"] and third["Jon Tam"].startswith("[PERSON_0_")
+    assert reloaded.clusters == {"PERSON_0": [["Jon Tam", "Jon Tan"]]}
+
+    # The first instance picks the other writer's changes up from disk
+    assert store.resolve_and_update({"persons": {}}) == {}
+    assert store.store == reloaded.store
+    assert store.clusters == reloaded.clusters
+
+
+def test_resolve_and_update_skips_saving_when_nothing_changed(tmp_path):
+    store_path, cluster_path = str(tmp_path / "identity_store.json"), str(tmp_path / "clusters.json")
+    store = IdentityStore(store_path, cluster_path)
+    store.resolve_and_update({"unlinked_pii": {"phone": ["555-0100"]}})
+    before = os.stat(store_path).st_mtime_ns
+
+    assert store.resolve_and_update({"unlinked_pii": {"phone": ["555-0100"]}}) == {}
+    assert os.stat(store_path).st_mtime_ns == before
+    assert not os.path.exists(cluster_path)
+
+
+def test_same_size_rewrite_within_mtime_granularity_is_reloaded(tmp_path):
+    store_path, cluster_path = str(tmp_path / "identity_store.json"), str(tmp_path / "clusters.json")
+    store = IdentityStore(store_path, cluster_path)
+    store.resolve_and_update({"unlinked_pii": {"phone": ["555-0100"]}})
+    st = os.stat(store_path)
+
+    # Another writer swaps in a same-size file and the clock doesn't visibly move
+    with open(store_path, "rb") as f:
+        rewritten = f.read().replace(b"555-0100", b"555-0199")
+    with open(f"{store_path}.other", "wb") as f:
+        f.write(rewritten)
+    os.replace(f"{store_path}.other", store_path)
+    os.utime(store_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.stat(store_path).st_size == st.st_size
+
+    assert store.resolve_and_update({"unlinked_pii": {"phone": ["555-0199"]}}) == {}
@@ -0,0 +1,35 @@
+# tests/test_masking.py
+
+from app.core.masking import _split_text, mask_text
+
+
+def test_value_inside_unfinished_longer_value_is_masked():
+    # A longer value that only partly matches, here at the end of the text, must not hide a shorter one
+    assert mask_text("Regards,\nLee Tan", {"Lee Tan Wei": "[P1]", "Tan": "[P2]"}) == "Regards,\nLee [P2]"
+    assert mask_text("Mary Lim", {"Mary Lim Hui Min": "[P1]", "Lim": "[P2]"}) == "Mary [P2]"
+
+
+def test_longest_value_wins_overlap():
+    masking_map = {"Tan": "[P2]", "Lee Tan Wei": "[P1]"}
+    assert mask_text("Lee Tan Wei and Tan", masking_map) == "[P1] and [P2]"
+
+
+def test_first_case_variant_keeps_its_placeholder():
+    masking_map = {"John": "[A]", "JOHN": "[B]"}
+    assert mask_text("john JOHN", masking_map) == "[A] [A]"
+    # Same rule on the regex fallback, taken when lowercasing changes the text's length
+    assert mask_text("İ john JOHN", masking_map) == "İ [A] [A]"
+
+
+def test_split_text_prefers_blank_lines():
+    assert _split_text("aaaa\n\nbbbb\n\ncccc", max_chars=10) == ["aaaa\n\nbbbb", "cccc"]
+
+
+def test_split_text_falls_back_to_lines_then_hard_cuts():
+    # PyMuPDF output and CRLF text have no blank lines, so long runs must still be split
+    crlf = "line one\r\n" * 50
+    chunks = _split_text(crlf, max_chars=100)
+    assert len(chunks) > 1 and all(len(chunk) <= 100 for chunk in chunks)
+    assert "\n".join(chunks) == crlf
+
+    assert _split_text("x" * 25, max_chars=10) == ["x" * 10, "x" * 10, "x" * 5]
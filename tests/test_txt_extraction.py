@@ -0,0 +1,14 @@
+# tests/test_txt_extraction.py
+
+import io
+
+from app.routes.documents import _extract_txt
+
+
+def test_newlines_are_normalised_like_text_mode():
+    raw = "Name: John Tan\r\n\r\nOld Mac line\rLast line\n".encode("utf-8")
+    assert _extract_txt(io.BytesIO(raw)) == "Name: John Tan\n\nOld Mac line\nLast line\n"
+
+
+def test_text_is_decoded_as_utf8():
+    assert _extract_txt(io.BytesIO("Zoë Lim\r\n".encode("utf-8"))) == "Zoë Lim\n"